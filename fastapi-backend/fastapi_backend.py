@@ -1,17 +1,34 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, BackgroundTasks, Header, status
+from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, BackgroundTasks, Header, Request, status
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional
 import os
 import uuid
 import asyncio
+import hashlib
+import json
+import time
+import shutil
+import subprocess
+import threading
+import select
 from video_processing_pipeline import VideoProcessor
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from contextlib import contextmanager
+import asyncpg
 import firebase_admin
 from firebase_admin import credentials, auth
 from minio import Minio
+from minio.deleteobjects import DeleteObject
+import certifi
+import urllib3
+from urllib3.util.retry import Retry
+from cachetools import TTLCache
+from redis import asyncio as aioredis
 import logging
+import queue
+import atexit
+from logging.handlers import QueueHandler, QueueListener
 from urllib.parse import urlparse
 from dotenv import load_dotenv
 import io
@@ -19,19 +36,40 @@ from datetime import datetime
 from datetime import timedelta
 import cv2
 import numpy as np
-from PIL import Image
 
 
 load_dotenv("/Users/tewff14/Documents/qmv3/.env")
 
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging: handlers only enqueue records, a listener thread does the writing
+log_queue = queue.Queue(-1)
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+log_listener = QueueListener(log_queue, log_handler)
+logging.basicConfig(level=logging.INFO, handlers=[QueueHandler(log_queue)], force=True)
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 
 # Initialize FastAPI app
 app = FastAPI(title="VideoSearch AI Backend", version="1.0.0")
 
+# Largest accepted upload request body
+MAX_UPLOAD_SIZE = int(os.getenv('MAX_UPLOAD_SIZE', 5 * 1024 * 1024 * 1024))
+
+# Registered before CORS so rejections still carry CORS headers
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """Reject oversized uploads from Content-Length before the body is read"""
+    if request.method == "POST" and request.url.path == "/api/videos/upload":
+        content_length = request.headers.get('content-length')
+        if content_length:
+            if not content_length.isdigit():
+                return JSONResponse(status_code=400, content={"detail": "Invalid Content-Length header"})
+            if int(content_length) > MAX_UPLOAD_SIZE:
+                return JSONResponse(status_code=413, content={"detail": "Video file is too large"})
+    return await call_next(request)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -68,27 +106,98 @@ except Exception as e:
     video_processor = None
 
 # MinIO client for file storage
+MINIO_BUCKET = os.getenv('MINIO_BUCKET_NAME', 'videosearch')
+MINIO_SECURE = os.getenv('MINIO_SECURE', 'false').lower() == 'true'
+MINIO_READ_TIMEOUT = 300
 try:
+    # One long-lived connection pool shared by every thread, sized for parallel
+    # range downloads plus concurrent API calls so connections stay warm
+    minio_http_client = urllib3.PoolManager(
+        maxsize=64,
+        block=False,
+        timeout=urllib3.Timeout(connect=300, read=MINIO_READ_TIMEOUT),
+        cert_reqs='CERT_REQUIRED',
+        ca_certs=os.getenv('SSL_CERT_FILE') or certifi.where(),
+        retries=Retry(total=2, backoff_factor=0.1, status_forcelist=[500, 502, 503, 504])
+    )
     minio_client = Minio(
         os.getenv('MINIO_ENDPOINT', 'localhost:9000'),
         # "tewgg14.totddns.com:64396",
         access_key=os.getenv('MINIO_ACCESS_KEY', 'minioadmin'),
         secret_key=os.getenv('MINIO_SECRET_KEY', 'minioadmin123'),
-        secure=os.getenv('MINIO_SECURE', 'false').lower() == 'true'
+        secure=MINIO_SECURE,
+        http_client=minio_http_client
     )
     logger.info("MinIO client initialized successfully")
 except Exception as e:
     logger.error(f"Failed to initialize MinIO client: {e}")
     minio_client = None
 
-# PostgreSQL connection function
-def get_db_connection():
+# Part size for multipart uploads to MinIO (also the single-PUT threshold)
+UPLOAD_PART_SIZE = 16 * 1024 * 1024
+
+# Byte-range size and number of concurrent range requests for MinIO downloads
+DOWNLOAD_CHUNK_SIZE = 16 * 1024 * 1024
+DOWNLOAD_CONCURRENCY = int(os.getenv('MINIO_DOWNLOAD_CONCURRENCY', 8))
+
+# ffmpeg binary used for thumbnail extraction (OpenCV is used when missing)
+FFMPEG_PATH = shutil.which('ffmpeg')
+THUMBNAIL_WIDTH = 320
+
+# Plain-HTTP range downloads are moved socket -> pipe -> file with splice(2) on Linux
+SPLICE_DOWNLOADS = hasattr(os, 'splice') and not MINIO_SECURE
+SPLICE_CHUNK_SIZE = 1024 * 1024
+
+# Presigned GET URLs are valid for two hours and reused for at most one, so every
+# URL handed out (thumbnails, video streams) still has a full hour of validity
+PRESIGNED_URL_EXPIRY = timedelta(hours=2)
+PRESIGNED_URL_MIN_VALIDITY = timedelta(hours=1)
+presigned_url_cache = TTLCache(
+    maxsize=10000, ttl=(PRESIGNED_URL_EXPIRY - PRESIGNED_URL_MIN_VALIDITY).total_seconds()
+)
+presigned_url_lock = threading.Lock()
+
+def get_presigned_url(object_name):
+    """Presign a GET URL for an object, reusing a cached URL while it is still valid"""
+    with presigned_url_lock:
+        url = presigned_url_cache.get(object_name)
+    if url is None:
+        url = minio_client.presigned_get_object(
+            MINIO_BUCKET,
+            object_name,
+            expires=PRESIGNED_URL_EXPIRY
+        )
+        with presigned_url_lock:
+            presigned_url_cache[object_name] = url
+    return url
+
+def sign_thumbnails(videos):
+    """Replace each video's thumbnail path with a presigned URL"""
+    for video in videos:
+        if video["thumbnail"]:
+            try:
+                video["thumbnail"] = get_presigned_url(video["thumbnail"])
+            except Exception as e:
+                logger.warning(f"Failed to generate presigned URL for thumbnail: {e}")
+                video["thumbnail"] = None
+
+# Redis ingest queue consumed by ingest_worker.py. Without REDIS_URL, videos
+# are processed in-process with BackgroundTasks.
+INGEST_QUEUE = os.getenv('INGEST_QUEUE', 'ingest')
+redis_url = os.getenv('REDIS_URL')
+redis_client = aioredis.from_url(redis_url, decode_responses=True) if redis_url else None
+
+# Videos up to this size are downloaded into memory (memfd) instead of /tmp
+VIDEO_MEMFD_MAX_SIZE = int(os.getenv('VIDEO_MEMFD_MAX_SIZE', 2 * 1024 * 1024 * 1024))
+
+# PostgreSQL connection settings
+def get_db_connection_params():
     database_url = os.getenv('DATABASE_URL')
     
     if database_url:
         # Parse DATABASE_URL (useful for production deployments like Heroku, Railway)
         url = urlparse(database_url)
-        return psycopg2.connect(
+        return dict(
             host=url.hostname,
             database=url.path[1:],  # Remove leading slash
             user=url.username,
@@ -97,7 +206,7 @@ def get_db_connection():
         )
     else:
         # Use individual environment variables
-        return psycopg2.connect(
+        return dict(
             host=os.getenv('POSTGRES_HOST', 'localhost'),
             database=os.getenv('POSTGRES_DB', 'videosearch'),
             user=os.getenv('POSTGRES_USER', 'videosearch'),
@@ -105,6 +214,55 @@ def get_db_connection():
             port=int(os.getenv('POSTGRES_PORT', 5432))
         )
 
+# PostgreSQL connection pool (asyncpg), shared by all requests and background tasks.
+# Keep POSTGRES_POOL_MAX below the server's max_connections minus headroom
+# for the video processor and admin sessions.
+db_pool = None
+
+async def init_db_pool():
+    """Create the asyncpg connection pool"""
+    global db_pool
+    try:
+        db_pool = await asyncpg.create_pool(
+            min_size=int(os.getenv('POSTGRES_POOL_MIN', 5)),
+            max_size=int(os.getenv('POSTGRES_POOL_MAX', 50)),
+            # Each connection prepares a query on first use and reuses the plan afterwards;
+            # set to 0 when running behind pgbouncer in transaction pooling mode
+            statement_cache_size=int(os.getenv('POSTGRES_STATEMENT_CACHE_SIZE', 100)),
+            **get_db_connection_params()
+        )
+        logger.info("PostgreSQL connection pool initialized successfully")
+    except Exception as e:
+        logger.error(f"Failed to initialize PostgreSQL connection pool: {e}")
+        db_pool = None
+
+async def db_query(query, params=(), fetch=None):
+    """Run a query on a pooled connection; fetch is None, 'one' or 'all'"""
+    if not db_pool:
+        raise HTTPException(status_code=500, detail="Database not available")
+    async with db_pool.acquire() as conn:
+        if fetch == 'one':
+            row = await conn.fetchrow(query, *params)
+            return dict(row) if row else None
+        if fetch == 'all':
+            return [dict(row) for row in await conn.fetch(query, *params)]
+        await conn.execute(query, *params)
+
+@app.on_event("startup")
+async def open_db_pool():
+    await init_db_pool()
+
+@app.on_event("startup")
+async def resume_bulk_inserts():
+    # Without a Redis ingest worker, videos are indexed (and imports watched) here
+    if video_processor and not redis_client:
+        await asyncio.to_thread(video_processor.resume_bulk_inserts)
+
+@app.on_event("shutdown")
+async def close_db_pool():
+    if db_pool:
+        await db_pool.close()
+
 # Pydantic models
 class VideoUploadResponse(BaseModel):
     video_id: int
@@ -134,6 +292,20 @@ class InVideoSearchResult(BaseModel):
     frame_number: int
     similarity: float
 
+# Verified Firebase ID tokens, keyed by token hash -> (uid, exp)
+token_cache = TTLCache(maxsize=10000, ttl=300)
+
+async def verify_token(token: str) -> str:
+    """Verify a Firebase ID token, reusing the result until it expires"""
+    key = hashlib.sha256(token.encode()).hexdigest()
+    cached = token_cache.get(key)
+    if cached and cached[1] > time.time():
+        return cached[0]
+    # Signature verification is CPU-bound, keep it off the event loop
+    decoded_token = await asyncio.to_thread(auth.verify_id_token, token)
+    token_cache[key] = (decoded_token['uid'], decoded_token['exp'])
+    return decoded_token['uid']
+
 # Authentication dependency
 async def get_current_user(authorization: Optional[str] = Header(None)):
     logger.info(f"Authorization header: {authorization}")
@@ -155,14 +327,39 @@ async def get_current_user(authorization: Optional[str] = Header(None)):
     logger.info(f"Extracted token: {token[:20]}...")
     
     try:
-        decoded_token = auth.verify_id_token(token)
-        user_id = decoded_token['uid']
+        user_id = await verify_token(token)
         logger.info(f"Successfully authenticated user: {user_id}")
         return user_id
     except Exception as e:
         logger.error(f"Token verification failed: {e}")
         raise HTTPException(status_code=401, detail=f"Invalid token: {str(e)}")
 
+# Top-level boxes an ISO BMFF file may start with (older QuickTime files skip ftyp)
+VIDEO_ISO_BMFF_BOXES = (b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide')
+# ftyp major brands of HEIF / AVIF still images, which share the ISO BMFF layout
+IMAGE_ISO_BMFF_BRANDS = (
+    b'heic', b'heix', b'heim', b'heis', b'hevc', b'hevx', b'mif1', b'msf1', b'avif', b'avis'
+)
+# Enough bytes to see the sync bytes of two consecutive MPEG-TS packets: 188-byte
+# packets, or 192-byte M2TS packets (AVCHD .MTS / .M2TS) with a 4-byte timecode prefix
+VIDEO_HEADER_SIZE = 197
+
+def is_video_container(header: bytes) -> bool:
+    """Check the leading bytes of a file against known video container signatures"""
+    if header[4:8] == b'ftyp' and header[8:12] in IMAGE_ISO_BMFF_BRANDS:
+        return False
+    return (
+        header[4:8] in VIDEO_ISO_BMFF_BOXES                     # MP4 / MOV / 3GP (ISO BMFF)
+        or header[:4] == b'\x1a\x45\xdf\xa3'                    # Matroska / WebM
+        or (header[:4] == b'RIFF' and header[8:12] == b'AVI ')  # AVI
+        or header[:4] == b'\x00\x00\x01\xba'                    # MPEG program stream
+        or (len(header) >= 189 and header[0] == 0x47 and header[188] == 0x47)  # MPEG-TS
+        or (len(header) >= 197 and header[4] == 0x47 and header[196] == 0x47)  # M2TS / AVCHD
+        or header[:3] == b'FLV'                                 # Flash video
+        or header[:4] == b'OggS'                                # Ogg
+        or header[:4] == b'\x30\x26\xb2\x75'                    # ASF / WMV
+    )
+
 @app.post("/api/videos/upload", response_model=VideoUploadResponse)
 async def upload_video(
     background_tasks: BackgroundTasks,
@@ -177,6 +374,10 @@ async def upload_video(
     # Validate file type
     if not file.content_type or not file.content_type.startswith('video/'):
         raise HTTPException(status_code=400, detail="File must be a video")
+    header = await file.read(VIDEO_HEADER_SIZE)
+    await file.seek(0)
+    if not is_video_container(header):
+        raise HTTPException(status_code=400, detail="File must be a video")
     
     # Generate unique filename
     file_extension = os.path.splitext(file.filename)[1] if file.filename else '.mp4'
@@ -188,33 +389,41 @@ async def upload_video(
         if not minio_client:
             raise HTTPException(status_code=500, detail="File storage not available")
             
-        file_data = await file.read()
-        minio_client.put_object(
-            os.getenv('MINIO_BUCKET_NAME', 'videosearch'),
+        # Stream the spooled upload to MinIO rather than reading it into memory.
+        # Files larger than one part are sent as a multipart upload.
+        file.file.seek(0, os.SEEK_END)
+        file_size = file.file.tell()
+        file.file.seek(0)
+        await asyncio.to_thread(
+            minio_client.put_object,
+            MINIO_BUCKET,
             minio_path,
-            data=io.BytesIO(file_data),  # Wrap bytes in BytesIO
-            length=len(file_data),
+            data=file.file,
+            length=file_size,
+            part_size=UPLOAD_PART_SIZE,
             content_type=file.content_type
         )
         
         # Create database record (thumbnail is NULL for now)
-        conn = get_db_connection()
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                """
-                INSERT INTO videos (user_id, title, minio_path, thumbnail, indexing_status)
-                VALUES (%s, %s, %s, %s, 'PENDING')
-                RETURNING id
-                """,
-                (user_id, title or file.filename, minio_path, None)
-            )
-            video_id = cursor.fetchone()['id']
-            conn.commit()
-        
-        conn.close()
+        row = await db_query(
+            """
+            INSERT INTO videos (user_id, title, minio_path, thumbnail, indexing_status)
+            VALUES ($1, $2, $3, $4, 'PENDING')
+            RETURNING id
+            """,
+            (user_id, title or file.filename, minio_path, None),
+            fetch='one'
+        )
+        video_id = row['id']
         
         # Start background processing (now also does thumbnail extraction)
-        if video_processor:
+        if redis_client:
+            await redis_client.rpush(INGEST_QUEUE, json.dumps({
+                "video_id": video_id,
+                "minio_path": minio_path,
+                "user_id": user_id
+            }))
+        elif video_processor:
             background_tasks.add_task(process_video_background, video_id, minio_path, user_id)
         
         logger.info(f"Video uploaded successfully: {video_id}")
@@ -227,21 +436,44 @@ async def upload_video(
         logger.error(f"Error uploading video: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to upload video: {str(e)}")
 
-def extract_and_upload_thumbnail(local_video_path, minio_client, user_id, video_id):
+def render_thumbnail(local_video_path):
+    """Return a JPEG thumbnail of the video's opening frame as bytes"""
+    if FFMPEG_PATH:
+        # -ss before -i is an input seek: ffmpeg jumps to the keyframe before 1s and
+        # only decodes from there, instead of decoding the video from the start
+        proc = subprocess.run(
+            [FFMPEG_PATH, '-loglevel', 'error', '-ss', '1', '-i', local_video_path,
+             '-vframes', '1', '-vf', f'scale={THUMBNAIL_WIDTH}:-1', '-f', 'image2pipe', '-vcodec', 'mjpeg', '-'],
+            capture_output=True
+        )
+        if proc.returncode == 0 and proc.stdout:
+            return proc.stdout
+        logger.warning(f"ffmpeg thumbnail extraction failed, falling back to OpenCV: {proc.stderr.decode(errors='replace').strip()}")
+
     cap = cv2.VideoCapture(local_video_path)
     ret, frame = cap.read()
     cap.release()
     if not ret:
         return None
-    # Convert BGR to RGB and save as JPEG in memory
-    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    pil_img = Image.fromarray(frame_rgb)
-    buf = io.BytesIO()
-    pil_img.save(buf, format='JPEG')
-    buf.seek(0)
+    # Downscale to thumbnail width and encode the BGR frame directly
+    height, width = frame.shape[:2]
+    if width > THUMBNAIL_WIDTH:
+        frame = cv2.resize(
+            frame, (THUMBNAIL_WIDTH, int(THUMBNAIL_WIDTH * height / width)), interpolation=cv2.INTER_AREA
+        )
+    ok, encoded = cv2.imencode(
+        '.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80, cv2.IMWRITE_JPEG_PROGRESSIVE, 1]
+    )
+    return encoded.tobytes() if ok else None
+
+def extract_and_upload_thumbnail(local_video_path, minio_client, user_id, video_id):
+    jpeg_bytes = render_thumbnail(local_video_path)
+    if not jpeg_bytes:
+        return None
+    buf = io.BytesIO(jpeg_bytes)
     thumbnail_path = f"thumbnails/{user_id}/{video_id}.jpg"
     minio_client.put_object(
-        os.getenv('MINIO_BUCKET_NAME', 'videosearch'),
+        MINIO_BUCKET,
         thumbnail_path,
         data=buf,
         length=buf.getbuffer().nbytes,
@@ -249,67 +481,180 @@ def extract_and_upload_thumbnail(local_video_path, minio_client, user_id, video_
     )
     return thumbnail_path
 
+def remove_objects(object_names):
+    """Delete several objects from MinIO in a single batch request"""
+    errors = minio_client.remove_objects(
+        MINIO_BUCKET,
+        [DeleteObject(name) for name in object_names]
+    )
+    # remove_objects is lazy; iterating the errors sends the request
+    for error in errors:
+        logger.warning(f"Failed to delete {error.name} from MinIO: {error.message}")
+
+def can_splice(response, length):
+    """Whether a response body is raw, unencoded bytes readable straight off the socket"""
+    headers = response.headers
+    return (
+        SPLICE_DOWNLOADS
+        and headers.get('content-length') == str(length)
+        and not headers.get('content-encoding')
+        and not headers.get('transfer-encoding')
+        and hasattr(getattr(response, '_fp', None), 'fp')
+    )
+
+def splice_response(response, fd, offset, length):
+    """Move a response body into fd at offset with splice(2), bypassing userspace copies"""
+    reader = response._fp.fp  # BufferedReader over the connection's socket
+    # Body bytes already pulled into the reader's buffer are written normally
+    buffered = reader.peek(length)[:length]
+    reader.read(len(buffered))
+    os.pwrite(fd, buffered, offset)
+    position = offset + len(buffered)
+    remaining = length - len(buffered)
+
+    sock_fd = reader.fileno()
+    # Keep the client's read timeout for each wait on the socket; poll() also
+    # works for fd numbers past select()'s 1024 limit
+    sock = getattr(reader.raw, '_sock', None)
+    timeout = (sock.gettimeout() if sock is not None else None) or MINIO_READ_TIMEOUT
+    poller = select.poll()
+    poller.register(sock_fd, select.POLLIN)
+    pipe_r, pipe_w = os.pipe()
+    try:
+        while remaining:
+            try:
+                moved = os.splice(sock_fd, pipe_w, min(remaining, SPLICE_CHUNK_SIZE))
+            except BlockingIOError:
+                # Sockets with a timeout are non-blocking at the OS level
+                if not poller.poll(timeout * 1000):
+                    raise TimeoutError(f"No data from MinIO for {timeout}s during a range download")
+                continue
+            if moved == 0:
+                raise ConnectionError("Connection closed before the byte range was complete")
+            remaining -= moved
+            while moved:
+                written = os.splice(pipe_r, fd, moved, offset_dst=position)
+                position += written
+                moved -= written
+    finally:
+        os.close(pipe_r)
+        os.close(pipe_w)
+
+def download_range(bucket, object_name, fd, offset, length):
+    """Fetch one byte range of an object and write it at the same file offset"""
+    response = minio_client.get_object(bucket, object_name, offset=offset, length=length)
+    try:
+        if can_splice(response, length):
+            splice_response(response, fd, offset, length)
+            # http.client never saw the body being read, so the connection can't be reused
+            response.close()
+        else:
+            position = offset
+            for data in response.stream(1024 * 1024):
+                os.pwrite(fd, data, position)
+                position += len(data)
+    except Exception:
+        response.close()
+        raise
+    finally:
+        # A fully read response goes back to the pool as a keep-alive connection
+        response.release_conn()
+
+async def download_object_parallel(bucket, object_name, fd, size):
+    """Download an object from MinIO into fd using concurrent 16MB-aligned range requests"""
+    # Reserve the full file up front so range writes don't fragment it
+    if size:
+        if hasattr(os, 'posix_fallocate'):
+            os.posix_fallocate(fd, 0, size)
+        else:
+            os.ftruncate(fd, size)
+
+    semaphore = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+    failed = False
+
+    async def fetch(offset):
+        nonlocal failed
+        length = min(DOWNLOAD_CHUNK_SIZE, size - offset)
+        async with semaphore:
+            # Ranges still queued when another one fails are never started
+            if failed:
+                return
+            try:
+                await asyncio.to_thread(download_range, bucket, object_name, fd, offset, length)
+            except Exception:
+                failed = True
+                raise
+
+    # Wait for every in-flight range before raising, so no thread is still
+    # writing to fd when the caller closes it
+    results = await asyncio.gather(
+        *(fetch(offset) for offset in range(0, size, DOWNLOAD_CHUNK_SIZE)),
+        return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+@contextmanager
+def video_buffer(video_id, size):
+    """Yield (fd, path) for a downloaded video, kept in memory when possible"""
+    if hasattr(os, 'memfd_create') and size <= VIDEO_MEMFD_MAX_SIZE:
+        # Anonymous in-memory file; decoders open it through /proc without touching disk
+        fd = os.memfd_create(f"video_{video_id}")
+        try:
+            yield fd, f"/proc/{os.getpid()}/fd/{fd}"
+        finally:
+            os.close(fd)
+    else:
+        path = f"/tmp/video_{video_id}.mp4"
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            yield fd, path
+        finally:
+            os.close(fd)
+            os.remove(path)
+
 async def process_video_background(video_id: int, minio_path: str, user_id: str):
     """Background task to process video and extract/upload thumbnail"""
     try:
         logger.info(f"[Index] Starting background processing for video_id={video_id}, minio_path={minio_path}")
-        print(f"[Index] Starting background processing for video_id={video_id}, minio_path={minio_path}")
 
-        # Download video from MinIO to temporary file
-        temp_file_path = f"/tmp/video_{video_id}.mp4"
-        logger.info(f"[Index] Downloading video from MinIO to {temp_file_path}")
-        print(f"[Index] Downloading video from MinIO to {temp_file_path}")
-        
-        # Run the blocking download in a separate thread to avoid freezing the API
-        await asyncio.to_thread(
-            minio_client.fget_object,
-            os.getenv('MINIO_BUCKET_NAME', 'videosearch'), 
-            minio_path, 
-            temp_file_path
-        )
+        stat = await asyncio.to_thread(minio_client.stat_object, MINIO_BUCKET, minio_path)
 
-        logger.info(f"[Index] Download complete: {temp_file_path}")
-        print(f"[Index] Download complete: {temp_file_path}")
+        with video_buffer(video_id, stat.size) as (fd, video_path):
+            logger.info(f"[Index] Downloading video from MinIO to {video_path}")
 
-        # Extract and upload thumbnail
-        thumbnail_path = await asyncio.to_thread(
-            extract_and_upload_thumbnail, temp_file_path, minio_client, user_id, video_id
-        )
-        if thumbnail_path:
-            # Update DB with thumbnail path
-            conn = get_db_connection()
-            with conn.cursor() as cursor:
-                cursor.execute(
-                    "UPDATE videos SET thumbnail = %s WHERE id = %s",
+            # Fetch the object as parallel byte ranges off the event loop
+            await download_object_parallel(MINIO_BUCKET, minio_path, fd, stat.size)
+
+            logger.info(f"[Index] Download complete: {video_path}")
+
+            # Extract and upload thumbnail
+            thumbnail_path = await asyncio.to_thread(
+                extract_and_upload_thumbnail, video_path, minio_client, user_id, video_id
+            )
+            if thumbnail_path:
+                # Update DB with thumbnail path
+                await db_query(
+                    "UPDATE videos SET thumbnail = $1 WHERE id = $2",
                     (thumbnail_path, video_id)
                 )
-                conn.commit()
-            conn.close()
-            logger.info(f"[Index] Thumbnail uploaded for video_id={video_id}: {thumbnail_path}")
-        else:
-            logger.warning(f"[Index] Failed to extract thumbnail for video_id={video_id}")
-
-        # Process video
-        if video_processor:
-            logger.info(f"[Index] Processing video: {temp_file_path}")
-            print(f"[Index] Processing video: {temp_file_path}")
-            await asyncio.to_thread(video_processor.process_video, video_id, temp_file_path)
-            logger.info(f"[Index] Video processing complete for video_id={video_id}")
-            print(f"[Index] Video processing complete for video_id={video_id}")
-        else:
-            logger.warning(f"[Index] Video processor not available for video_id={video_id}")
-            print(f"[Index] Video processor not available for video_id={video_id}")
+                logger.info(f"[Index] Thumbnail uploaded for video_id={video_id}: {thumbnail_path}")
+            else:
+                logger.warning(f"[Index] Failed to extract thumbnail for video_id={video_id}")
+
+            # Process video
+            if video_processor:
+                logger.info(f"[Index] Processing video: {video_path}")
+                await asyncio.to_thread(video_processor.process_video, video_id, video_path, user_id)
+                logger.info(f"[Index] Video processing complete for video_id={video_id}")
+            else:
+                logger.warning(f"[Index] Video processor not available for video_id={video_id}")
 
-        # Clean up temporary file
-        logger.info(f"[Index] Removing temporary file: {temp_file_path}")
-        print(f"[Index] Removing temporary file: {temp_file_path}")
-        os.remove(temp_file_path)
-        logger.info(f"[Index] Temporary file removed: {temp_file_path}")
-        print(f"[Index] Temporary file removed: {temp_file_path}")
+        logger.info(f"[Index] Released video buffer for video_id={video_id}")
 
     except Exception as e:
         logger.error(f"[Index] Error processing video {video_id}: {e}")
-        print(f"[Index] Error processing video {video_id}: {e}")
 
 @app.get("/api/videos", response_model=List[VideoInfo])
 async def get_user_videos(user_id: str = Depends(get_current_user)):
@@ -317,121 +662,85 @@ async def get_user_videos(user_id: str = Depends(get_current_user)):
     
     logger.info(f"Fetching videos for user: {user_id}")
     
-    conn = get_db_connection()
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                """
-                SELECT id, title, minio_path, thumbnail, indexing_status, created_at
-                FROM videos
-                WHERE user_id = %s
-                ORDER BY created_at DESC
-                """,
-                (user_id,)
-            )
-            videos = cursor.fetchall()
+        videos = await db_query(
+            """
+            SELECT id, title, minio_path, thumbnail, indexing_status, created_at
+            FROM videos
+            WHERE user_id = $1
+            ORDER BY created_at DESC
+            """,
+            (user_id,),
+            fetch='all'
+        )
         logger.info(f"Found {len(videos)} videos for user {user_id}")
-        # Generate presigned URL for thumbnail if exists
-        for video in videos:
-            if video["thumbnail"]:
-                try:
-                    video["thumbnail"] = minio_client.presigned_get_object(
-                        os.getenv('MINIO_BUCKET_NAME', 'videosearch'),
-                        video["thumbnail"],
-                        expires=timedelta(hours=1)
-                    )
-                except Exception as e:
-                    logger.warning(f"Failed to generate presigned URL for thumbnail: {e}")
-                    video["thumbnail"] = None
+        # Generate presigned URLs for thumbnails in a single worker-thread pass
+        await asyncio.to_thread(sign_thumbnails, videos)
         return [VideoInfo(**{**video, "created_at": video["created_at"].isoformat()}) for video in videos]
     except Exception as e:
         logger.error(f"Error fetching videos: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch videos")
-    finally:
-        conn.close()
 
 @app.get("/api/videos/{video_id}", response_model=VideoInfo)
 async def get_video(video_id: int, user_id: str = Depends(get_current_user)):
     """Get specific video information"""
     
-    conn = get_db_connection()
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                """
-                SELECT id, title, minio_path, thumbnail, indexing_status, created_at
-                FROM videos
-                WHERE id = %s AND user_id = %s
-                """,
-                (video_id, user_id)
-            )
-            video = cursor.fetchone()
+        video = await db_query(
+            """
+            SELECT id, title, minio_path, thumbnail, indexing_status, created_at
+            FROM videos
+            WHERE id = $1 AND user_id = $2
+            """,
+            (video_id, user_id),
+            fetch='one'
+        )
         if not video:
             raise HTTPException(status_code=404, detail="Video not found")
         # Generate presigned URL for thumbnail if exists
-        if video["thumbnail"]:
-            try:
-                video["thumbnail"] = minio_client.presigned_get_object(
-                    os.getenv('MINIO_BUCKET_NAME', 'videosearch'),
-                    video["thumbnail"],
-                    expires=timedelta(hours=1)
-                )
-            except Exception as e:
-                logger.warning(f"Failed to generate presigned URL for thumbnail: {e}")
-                video["thumbnail"] = None
+        await asyncio.to_thread(sign_thumbnails, [video])
         return VideoInfo(**video)
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Error fetching video: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch video")
-    finally:
-        conn.close()
 
 @app.delete("/api/videos/{video_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_video(video_id: int, user_id: str = Depends(get_current_user)):
     """Delete a video: remove from MinIO, Milvus, and Postgres"""
     # Fetch video info
-    conn = get_db_connection()
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                "SELECT minio_path, thumbnail FROM videos WHERE id = %s AND user_id = %s",
-                (video_id, user_id)
-            )
-            video = cursor.fetchone()
-        if not video:
-            raise HTTPException(status_code=404, detail="Video not found")
-        minio_path = video["minio_path"]
-        thumbnail_path = video["thumbnail"]
-    finally:
-        conn.close()
+    video = await db_query(
+        "SELECT minio_path, thumbnail FROM videos WHERE id = $1 AND user_id = $2",
+        (video_id, user_id),
+        fetch='one'
+    )
+    if not video:
+        raise HTTPException(status_code=404, detail="Video not found")
+    minio_path = video["minio_path"]
+    thumbnail_path = video["thumbnail"]
 
-    # Delete video file from MinIO
-    try:
-        minio_client.remove_object(os.getenv('MINIO_BUCKET_NAME', 'videosearch'), minio_path)
-    except Exception as e:
-        logger.warning(f"Failed to delete video file from MinIO: {e}")
-    # Delete thumbnail from MinIO
-    if thumbnail_path:
+    object_names = [minio_path] + ([thumbnail_path] if thumbnail_path else [])
+
+    async def delete_from_minio():
         try:
-            minio_client.remove_object(os.getenv('MINIO_BUCKET_NAME', 'videosearch'), thumbnail_path)
+            await asyncio.to_thread(remove_objects, object_names)
         except Exception as e:
-            logger.warning(f"Failed to delete thumbnail from MinIO: {e}")
-    # Delete frames from Milvus
-    try:
-        if video_processor:
-            video_processor.delete_video_frames(video_id)
-    except Exception as e:
-        logger.warning(f"Failed to delete frames from Milvus: {e}")
-    # Delete from Postgres
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute("DELETE FROM videos WHERE id = %s AND user_id = %s", (video_id, user_id))
-            conn.commit()
-    finally:
-        conn.close()
+            logger.warning(f"Failed to delete video files from MinIO: {e}")
+
+    async def delete_from_milvus():
+        try:
+            if video_processor:
+                await asyncio.to_thread(video_processor.delete_video_frames, video_id)
+        except Exception as e:
+            logger.warning(f"Failed to delete frames from Milvus: {e}")
+
+    # MinIO, Milvus and Postgres deletes are independent, run them concurrently
+    await asyncio.gather(
+        delete_from_minio(),
+        delete_from_milvus(),
+        db_query("DELETE FROM videos WHERE id = $1 AND user_id = $2", (video_id, user_id))
+    )
     return
 
 @app.post("/api/search/global", response_model=List[SearchResult])
@@ -445,10 +754,12 @@ async def global_search(
         raise HTTPException(status_code=503, detail="Search service not available")
     
     try:
-        results = video_processor.search_global(
+        # Concurrent searches are encoded and run in batches by the processor
+        results = await asyncio.to_thread(
+            video_processor.search_global,
             query_text=request.query,
             user_id=user_id,
-            limit=request.limit
+            limit=request.limit or 5
         )
         
         return [SearchResult(**result) for result in results]
@@ -466,26 +777,24 @@ async def search_in_video(
     """Perform semantic search within a specific video"""
     
     # Verify user owns the video
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute(
-                "SELECT id FROM videos WHERE id = %s AND user_id = %s AND indexing_status = 'COMPLETED'",
-                (video_id, user_id)
-            )
-            if not cursor.fetchone():
-                raise HTTPException(status_code=404, detail="Video not found or not ready for search")
-    finally:
-        conn.close()
+    video = await db_query(
+        "SELECT id FROM videos WHERE id = $1 AND user_id = $2 AND indexing_status = 'COMPLETED'",
+        (video_id, user_id),
+        fetch='one'
+    )
+    if not video:
+        raise HTTPException(status_code=404, detail="Video not found or not ready for search")
     
     if not video_processor:
         raise HTTPException(status_code=503, detail="Search service not available")
     
     try:
-        results = video_processor.search_in_video(
+        results = await asyncio.to_thread(
+            video_processor.search_in_video,
             query_text=request.query,
             video_id=video_id,
-            limit=request.limit or 10
+            limit=request.limit or 10,
+            user_id=user_id
         )
         
         return [InVideoSearchResult(**result) for result in results]
@@ -499,14 +808,12 @@ async def stream_video(video_id: int, user_id: str = Depends(get_current_user)):
     """Stream video file from MinIO"""
     
     # Verify user owns the video
-    conn = get_db_connection()
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                "SELECT minio_path FROM videos WHERE id = %s AND user_id = %s",
-                (video_id, user_id)
-            )
-            video = cursor.fetchone()
+        video = await db_query(
+            "SELECT minio_path FROM videos WHERE id = $1 AND user_id = $2",
+            (video_id, user_id),
+            fetch='one'
+        )
             
         if not video:
             raise HTTPException(status_code=404, detail="Video not found")
@@ -514,14 +821,8 @@ async def stream_video(video_id: int, user_id: str = Depends(get_current_user)):
         if not minio_client:
             raise HTTPException(status_code=500, detail="File storage not available")
             
-        # Generate presigned URL for video streaming
-        presigned_url = minio_client.presigned_get_object(
-            os.getenv('MINIO_BUCKET_NAME', 'videosearch'),
-            video['minio_path'],
-            expires=timedelta(seconds=3600)  # 1 hour
-        )
-
-        print(presigned_url)
+        # Generate presigned URL for video streaming (1 hour, cached across requests)
+        presigned_url = await asyncio.to_thread(get_presigned_url, video['minio_path'])
         return {"stream_url": presigned_url}
         
     except HTTPException:
@@ -529,8 +830,6 @@ async def stream_video(video_id: int, user_id: str = Depends(get_current_user)):
     except Exception as e:
         logger.error(f"Error streaming video: {e}")
         raise HTTPException(status_code=500, detail="Failed to stream video")
-    finally:
-        conn.close()
 
 @app.get("/health")
 async def health_check():
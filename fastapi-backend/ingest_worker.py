@@ -0,0 +1,39 @@
+import asyncio
+import json
+import logging
+import os
+
+import fastapi_backend
+from fastapi_backend import INGEST_QUEUE, redis_client, video_processor, init_db_pool, process_video_background
+
+
+logger = logging.getLogger(__name__)
+
+# Number of videos this worker process indexes at the same time
+INGEST_CONCURRENCY = int(os.getenv('INGEST_CONCURRENCY', 1))
+
+async def consume(worker_id: int):
+    """Pop ingest jobs off the Redis queue and process them one at a time"""
+    while True:
+        _, payload = await redis_client.blpop(INGEST_QUEUE)
+        job = json.loads(payload)
+        logger.info(f"[Worker {worker_id}] Picked up video_id={job['video_id']}")
+        await process_video_background(job['video_id'], job['minio_path'], job['user_id'])
+
+async def main():
+    if not redis_client:
+        raise RuntimeError("REDIS_URL must be set to run the ingest worker")
+    if not video_processor:
+        # Jobs would only get a thumbnail and be dropped, leaving videos PENDING
+        raise RuntimeError("Video processor failed to initialize; refusing to consume ingest jobs")
+    await init_db_pool()
+    # init_db_pool only logs connection errors; jobs would then fail after being popped
+    if fastapi_backend.db_pool is None:
+        raise RuntimeError("PostgreSQL connection pool failed to initialize; refusing to consume ingest jobs")
+    # Watch bulk imports left running by a previous worker process
+    await asyncio.to_thread(video_processor.resume_bulk_inserts)
+    logger.info(f"Ingest worker listening on '{INGEST_QUEUE}' with concurrency {INGEST_CONCURRENCY}")
+    await asyncio.gather(*(consume(i) for i in range(INGEST_CONCURRENCY)))
+
+if __name__ == "__main__":
+    asyncio.run(main())
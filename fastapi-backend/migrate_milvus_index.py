@@ -0,0 +1,21 @@
+import logging
+import os
+
+from pymilvus import connections, Collection, utility
+
+from video_processing_pipeline import MILVUS_COLLECTION_NAME, rebuild_index
+
+
+logger = logging.getLogger(__name__)
+
+# One-off migration: rebuild the frame embedding index as HNSW. Searches are
+# unavailable while it runs, so stop the API and ingest workers first.
+def main():
+    connections.connect("default", host=os.getenv('MILVUS_HOST', 'localhost'), port="19530")
+    if not utility.has_collection(MILVUS_COLLECTION_NAME):
+        logger.info(f"No '{MILVUS_COLLECTION_NAME}' collection yet; it is created with an HNSW index")
+        return
+    rebuild_index(Collection(MILVUS_COLLECTION_NAME))
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,31 @@
 import cv2
 import numpy as np
 import torch
-from PIL import Image
+import torch.nn.functional as F
+import torchvision
 import clip
+import onnxruntime as ort
+from onnxruntime.quantization import quantize_dynamic, QuantType
 import asyncio
 import aiofiles
 from minio import Minio
-from pymilvus import connections, Collection, FieldSchema, CollectionSchema, DataType, utility
-import psycopg2
+from cachetools import TTLCache
+from pymilvus import connections, Collection, FieldSchema, CollectionSchema, DataType, utility, BulkInsertState
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool
 import os
+import io
+import re
+import hashlib
+import time
 import logging
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Iterator, Union, Optional
 import json
+import queue
+import threading
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 from urllib.parse import urlparse
 from dotenv import load_dotenv
 
@@ -24,14 +37,122 @@ load_dotenv("/Users/tewff14/Documents/qmv3/.env")
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# CLIP image normalization constants (RGB)
+CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
+
+# CLIP model, and where its ONNX exports are cached for CPU hosts
+CLIP_MODEL_NAME = "ViT-B/32"
+CLIP_ONNX_DIR = os.getenv('CLIP_ONNX_DIR', os.path.expanduser('~/.cache/clip/onnx'))
+ONNX_PROVIDERS = ['OpenVINOExecutionProvider', 'CPUExecutionProvider']
+
+class ClipEncoder(torch.nn.Module):
+    """Exposes one of CLIP's encode_* methods as a module for ONNX export"""
+    def __init__(self, model, method: str):
+        super().__init__()
+        self.model = model
+        self.method = method
+    
+    def forward(self, x):
+        return getattr(self.model, self.method)(x)
+
+# HNSW graph index: much lower query latency than IVF at equivalent recall
+INDEX_PARAMS = {
+    "metric_type": "COSINE",
+    "index_type": "HNSW",
+    "params": {"M": 16, "efConstruction": 200}
+}
+HNSW_SEARCH_EF = 64
+
+MILVUS_COLLECTION_NAME = "video_frames"
+
+def search_params(index_type: str, topk: int) -> Dict:
+    """Search params for the collection's index type; HNSW requires ef >= topk"""
+    if index_type == "HNSW":
+        return {"metric_type": "COSINE", "params": {"ef": max(HNSW_SEARCH_EF, topk)}}
+    # IVF indexes from older deployments, until migrate_milvus_index.py is run
+    return {"metric_type": "COSINE", "params": {"nprobe": 10}}
+
+def rebuild_index(collection: Collection):
+    """Rebuild a collection's embedding index as HNSW; a one-off offline migration"""
+    indexes = collection.indexes
+    if indexes and indexes[0].params.get("index_type") == INDEX_PARAMS["index_type"]:
+        logger.info(f"Index on '{collection.name}' is already {INDEX_PARAMS['index_type']}")
+        return
+    logger.info(f"Rebuilding index on '{collection.name}' as {INDEX_PARAMS['index_type']}")
+    collection.release()
+    if indexes:
+        collection.drop_index()
+    collection.create_index("embedding", INDEX_PARAMS)
+    utility.wait_for_index_building_complete(collection.name)
+    collection.load()
+    logger.info(f"Index on '{collection.name}' rebuilt and collection reloaded")
+
+# Milvus caps topk per search; global search starts at limit * oversample hits
+MILVUS_MAX_TOPK = 16384
+GLOBAL_SEARCH_OVERSAMPLE = 20
+
+# Frames per CLIP batch and batches buffered between pipeline stages
+PIPELINE_BATCH_SIZE = 32
+PIPELINE_QUEUE_SIZE = 4
+# Pixels converted to float32 at once during preprocessing (8 frames at 1080p, 2 at 4K)
+PREPROCESS_MAX_PIXELS = 8 * 1920 * 1080
+
+# Concurrent searches are collected for up to QUERY_BATCH_WAIT seconds, then
+# encoded in one CLIP pass and sent as one multi-vector search per expression
+QUERY_BATCH_SIZE = 16
+QUERY_BATCH_WAIT = 0.005
+QUERY_SEARCH_WORKERS = 8
+SEARCH_OUTPUT_FIELDS = ["video_id", "frame_number", "timestamp_sec"]
+
+def user_partition_name(user_id: str) -> str:
+    """Milvus partition holding a user's frames; names only allow letters, digits and _"""
+    if not re.fullmatch(r"[A-Za-z0-9_]{1,200}", user_id):
+        user_id = hashlib.sha256(user_id.encode()).hexdigest()
+    return f"user_{user_id}"
+
+# Frames indexed before per-user partitions stay in the default partition
+DEFAULT_PARTITION = "_default"
+# Seconds a "user has no partition" lookup is cached
+PARTITION_MISS_TTL = 300
+
+# Videos with more frames than this send the rest through Milvus bulk import
+# (staged as .npy columns in Milvus' own MinIO bucket) instead of the WAL.
+# Opt-in: MILVUS_BUCKET_NAME must name the bucket Milvus reads from, reachable
+# with this app's MinIO credentials. Imports are watched from a thread; after a
+# restart, resume_bulk_inserts() picks up the ones whose video is still INDEXING
+BULK_INSERT_THRESHOLD = int(os.getenv('MILVUS_BULK_INSERT_THRESHOLD', 1000))
+MILVUS_BUCKET_NAME = os.getenv('MILVUS_BUCKET_NAME')
+BULK_INSERT_ENABLED = bool(MILVUS_BUCKET_NAME)
+BULK_INSERT_POLL_INTERVAL = 2.0
+
+def put_until_stopped(q: queue.Queue, item, stop: threading.Event) -> bool:
+    """Put onto a bounded queue, giving up once the pipeline has been stopped"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def get_until_stopped(q: queue.Queue, stop: threading.Event):
+    """Get from a queue, returning None once the pipeline has been stopped"""
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return None
+
 # PostgreSQL connection - support both individual vars and DATABASE_URL
-def get_db_connection():
+def get_db_connection_params():
     database_url = os.getenv('DATABASE_URL')
     
     if database_url:
         # Parse DATABASE_URL (useful for production deployments)
         url = urlparse(database_url)
-        return psycopg2.connect(
+        return dict(
             host=url.hostname,
             database=url.path[1:],  # Remove leading slash
             user=url.username,
@@ -40,7 +161,7 @@ def get_db_connection():
         )
     else:
         # Use individual environment variables
-        return psycopg2.connect(
+        return dict(
             host=os.getenv('POSTGRES_HOST', 'localhost'),
             database=os.getenv('POSTGRES_DB', 'videosearch'),
             user=os.getenv('POSTGRES_USER'),
@@ -48,11 +169,136 @@ def get_db_connection():
             port=os.getenv('POSTGRES_PORT', 5432)
         )
 
+# Connections used by the pipeline threads and search calls
+PG_POOL_MAX = int(os.getenv('PIPELINE_POSTGRES_POOL_MAX', 8))
+
+# Statements prepared once on each pooled connection and run with EXECUTE
+PREPARED_STATEMENTS = {
+    "upd_status": "UPDATE videos SET indexing_status = $1, updated_at = CURRENT_TIMESTAMP WHERE id = $2",
+    "completed_user_videos": "SELECT id, title FROM videos WHERE user_id = $1 AND indexing_status = 'COMPLETED'",
+}
+
+class QueryBatcher:
+    """Batches concurrent searches: one text-encoder pass, one Milvus request per filter"""
+    def __init__(self, processor):
+        self.processor = processor
+        self.queue = queue.Queue()
+        # Milvus requests for different filters run concurrently, off the batching thread
+        self.search_pool = ThreadPoolExecutor(max_workers=QUERY_SEARCH_WORKERS, thread_name_prefix="query-search")
+        self.worker = threading.Thread(target=self.run, name="query-batcher", daemon=True)
+        self.worker.start()
+    
+    def search(self, query: Union[str, List[float]], expr: str, topk: int, partition_names: Optional[List[str]] = None):
+        """Search for a query text (or an already encoded vector), returning (vector, hits)"""
+        # Tokenize on the caller's thread so a bad query (e.g. over CLIP's 77-token
+        # context) fails only its own request, not the whole batch
+        if isinstance(query, str):
+            query = clip.tokenize([query])
+        future = Future()
+        partitions = tuple(partition_names) if partition_names else None
+        self.queue.put((query, (expr, partitions), topk, future))
+        return future.result()
+    
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + QUERY_BATCH_WAIT
+            while len(batch) < QUERY_BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            
+            try:
+                self.run_batch(batch)
+            except Exception as e:
+                logger.error(f"Error in search batch: {e}")
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+    
+    def run_batch(self, batch):
+        # Encode every tokenized text query in the batch at once
+        tokens = [query for query, *_ in batch if isinstance(query, torch.Tensor)]
+        encoded = iter(self.processor.encode_tokens(torch.cat(tokens)).tolist() if tokens else [])
+        vectors = [next(encoded) if isinstance(query, torch.Tensor) else query for query, *_ in batch]
+        
+        # Queries sharing a filter, partitions and topk go to Milvus as one multi-vector search
+        groups = {}
+        for i, (_, scope, topk, _) in enumerate(batch):
+            groups.setdefault((scope, topk), []).append(i)
+        
+        for (scope, topk), indices in groups.items():
+            self.search_pool.submit(
+                self.search_group, scope, topk,
+                [vectors[i] for i in indices], [batch[i][3] for i in indices]
+            )
+    
+    def search_group(self, scope, topk: int, vectors: List[List[float]], futures: List[Future]):
+        """Run one multi-vector Milvus search and resolve each query's future"""
+        expr, partitions = scope
+        try:
+            search_results = self.processor.collection.search(
+                data=vectors,
+                anns_field="embedding",
+                param=search_params(self.processor.index_type, topk),
+                limit=topk,
+                expr=expr,
+                partition_names=list(partitions) if partitions else None,
+                output_fields=SEARCH_OUTPUT_FIELDS
+            )
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+        for future, vector, hits in zip(futures, vectors, search_results):
+            future.set_result((vector, hits))
+
 class VideoProcessor:
     def __init__(self):
         # Initialize CLIP model
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.model, self.preprocess = clip.load("ViT-B/32", device=self.device)
+        self.model, self.preprocess = clip.load(CLIP_MODEL_NAME, device=self.device)
+        self.model.eval()
+        self.input_resolution = self.model.visual.input_resolution
+        self.clip_mean = torch.tensor(CLIP_MEAN, device=self.device).view(1, 3, 1, 1)
+        self.clip_std = torch.tensor(CLIP_STD, device=self.device).view(1, 3, 1, 1)
+        # Allow TF32 tensor-core matmuls for any remaining FP32 GEMMs
+        torch.set_float32_matmul_precision('high')
+        
+        # Compile the image encoder on GPU (PyTorch >= 2.0). Default mode rather than
+        # reduce-overhead: CUDA graphs don't mix with videos encoded from several threads
+        self.encode_image = self.model.encode_image
+        self.compiled_encoder = (
+            self.device == "cuda"
+            and hasattr(torch, 'compile')
+            and os.getenv('CLIP_COMPILE', 'true').lower() == 'true'
+        )
+        if self.compiled_encoder:
+            self.encode_image = torch.compile(self.model.encode_image)
+        
+        # On CPU hosts run both encoders through ONNX Runtime (oneDNN / OpenVINO kernels)
+        self.encode_text = self.model.encode_text
+        if self.device == "cpu" and os.getenv('CLIP_ONNX', 'true').lower() == 'true':
+            try:
+                self.encode_image, self.encode_text = self.load_onnx_encoders()
+            except Exception as e:
+                logger.warning(f"ONNX Runtime CLIP encoders unavailable, using PyTorch: {e}")
+        
+        # Micro-batches text encoding and Milvus searches across concurrent callers
+        self.query_batcher = QueryBatcher(self)
+        
+        # Side stream for host-to-device frame copies, overlapping CLIP compute
+        self.copy_stream = torch.cuda.Stream() if self.device == "cuda" else None
+        
+        # Decode on the GPU (NVDEC) when torchvision was built with its GPU decoder
+        self.gpu_decode = self.device == "cuda" and getattr(torchvision.io, '_HAS_GPU_VIDEO_DECODER', False)
+        if self.gpu_decode:
+            torchvision.set_video_backend("cuda")
+            logger.info("Using NVDEC GPU video decoding")
         
         # Initialize MinIO client
         self.minio_client = Minio(
@@ -62,8 +308,11 @@ class VideoProcessor:
             secure=False
         )
         
-        # Initialize PostgreSQL connection using the function
-        self.pg_conn = get_db_connection()
+        # Initialize PostgreSQL connection pool; the semaphore makes callers wait
+        # for a free connection instead of getting PoolError when it is exhausted
+        self.pg_pool = ThreadedConnectionPool(1, PG_POOL_MAX, **get_db_connection_params())
+        self.pg_slots = threading.BoundedSemaphore(PG_POOL_MAX)
+        self.prepared_conns = weakref.WeakSet()
         
         # Initialize Milvus connection
         connections.connect("default", host=os.getenv('MILVUS_HOST', 'localhost'), port="19530")
@@ -71,14 +320,15 @@ class VideoProcessor:
     
     def setup_milvus_collection(self):
         """Setup Milvus collection for storing video frame embeddings"""
-        collection_name = "video_frames"
+        collection_name = MILVUS_COLLECTION_NAME
 
         if not utility.has_collection(collection_name):
             # If collection doesn't exist, create it
             fields = [
                 FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=True),
-                FieldSchema(name="video_id", dtype=DataType.INT64),
-                FieldSchema(name="frame_number", dtype=DataType.INT64),
+                # videos.id is a SERIAL (int4), so neither column needs 64 bits
+                FieldSchema(name="video_id", dtype=DataType.INT32),
+                FieldSchema(name="frame_number", dtype=DataType.INT32),
                 FieldSchema(name="timestamp_sec", dtype=DataType.FLOAT),
                 FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=512)
             ]
@@ -87,213 +337,672 @@ class VideoProcessor:
             logger.info(f"Created new Milvus collection: '{collection_name}'")
 
             # Create index after creating collection
-            index_params = {
-                "metric_type": "COSINE",
-                "index_type": "IVF_FLAT",
-                "params": {"nlist": 128}
-            }
-            self.collection.create_index("embedding", index_params)
+            self.collection.create_index("embedding", INDEX_PARAMS)
             logger.info("Created index on 'embedding' field.")
+            self.index_type = INDEX_PARAMS["index_type"]
         else:
             # If collection exists, just connect to it
             self.collection = Collection(collection_name)
             logger.info(f"Connected to existing Milvus collection: '{collection_name}'")
+            
+            # Older deployments keep serving from their IVF index; rebuilding it as
+            # HNSW is an explicit offline step, not something every process races to do
+            indexes = self.collection.indexes
+            self.index_type = indexes[0].params.get("index_type") if indexes else None
+            if self.index_type != INDEX_PARAMS["index_type"]:
+                logger.warning(
+                    f"Collection '{collection_name}' has a {self.index_type} index; "
+                    f"run migrate_milvus_index.py to rebuild it as {INDEX_PARAMS['index_type']}"
+                )
 
+        # Collections created before the INT32 schema keep INT64 columns; bulk
+        # import files must match the collection's field types exactly
+        self.int_field_dtypes = {
+            field.name: np.int32 if field.dtype == DataType.INT32 else np.int64
+            for field in self.collection.schema.fields
+            if field.name in ("video_id", "frame_number")
+        }
+        
         self.collection.load()
         logger.info(f"Collection '{collection_name}' loaded.")
+        
+        # Per-user partitions known to exist; other processes may add more. Misses are
+        # cached briefly, keyed by the videos the caller saw, so users without a partition
+        # don't cost a has_partition RPC per search
+        self.partitions = {partition.name for partition in self.collection.partitions}
+        self.partition_misses = TTLCache(maxsize=10000, ttl=PARTITION_MISS_TTL)
+        self.partitions_lock = threading.Lock()
     
-    def extract_frames(self, video_path: str, fps: float = 1.0) -> List[Tuple[np.ndarray, float]]:
-        """Extract frames from video at specified FPS"""
-        cap = cv2.VideoCapture(video_path)
-        frames = []
+    def ensure_user_partition(self, user_id: str) -> str:
+        """Create (and load) the user's partition on their first insert, else fall back to the default one"""
+        name = user_partition_name(user_id)
+        with self.partitions_lock:
+            if name not in self.partitions:
+                if not self.collection.has_partition(name):
+                    try:
+                        self.collection.create_partition(name).load()
+                    except Exception as e:
+                        # e.g. rootCoord.maxPartitionNum reached; searches always cover the default partition
+                        logger.warning(f"Could not create Milvus partition '{name}', using '{DEFAULT_PARTITION}': {e}")
+                        return DEFAULT_PARTITION
+                    logger.info(f"Created Milvus partition '{name}'")
+                self.partitions.add(name)
+        return name
+    
+    def user_search_partitions(self, user_id: str, videos_key) -> List[str]:
+        """Partitions that can hold a user's frames: theirs, if it exists, plus the default one.
         
-        video_fps = cap.get(cv2.CAP_PROP_FPS)
-        frame_interval = int(video_fps / fps)
+        videos_key identifies the COMPLETED videos the caller is searching, so a
+        newly indexed video (which may have created the partition) skips a cached miss.
+        """
+        name = user_partition_name(user_id)
+        if name not in self.partitions:
+            with self.partitions_lock:
+                missed = (name, videos_key) in self.partition_misses
+            if missed:
+                return [DEFAULT_PARTITION]
+            if not self.collection.has_partition(name):
+                with self.partitions_lock:
+                    self.partition_misses[(name, videos_key)] = True
+                return [DEFAULT_PARTITION]
+            with self.partitions_lock:
+                self.partitions.add(name)
+        return [name, DEFAULT_PARTITION]
+    
+    def load_onnx_encoders(self):
+        """Export the CLIP image and text encoders to ONNX once and wrap ONNX Runtime sessions"""
+        os.makedirs(CLIP_ONNX_DIR, exist_ok=True)
+        quantize = os.getenv('CLIP_ONNX_QUANTIZE', 'true').lower() == 'true'
+        providers = [p for p in ONNX_PROVIDERS if p in ort.get_available_providers()]
+        model_name = CLIP_MODEL_NAME.replace('/', '-')
+        size = self.input_resolution
+        dummy_inputs = {
+            'encode_image': torch.zeros(1, 3, size, size),
+            'encode_text': clip.tokenize(["a photo"]),
+        }
         
-        frame_count = 0
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
+        encoders = []
+        for method, dummy in dummy_inputs.items():
+            path = os.path.join(CLIP_ONNX_DIR, f"clip_{model_name}_{method}.onnx")
+            if not os.path.exists(path):
+                # Export to a temp file first so concurrent workers never load a partial model
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                torch.onnx.export(
+                    ClipEncoder(self.model, method), dummy, tmp_path,
+                    input_names=['input'], output_names=['output'],
+                    dynamic_axes={'input': {0: 'N'}, 'output': {0: 'N'}},
+                    opset_version=17
+                )
+                os.replace(tmp_path, path)
+                logger.info(f"Exported CLIP {method} to {path}")
             
-            if frame_count % frame_interval == 0:
-                timestamp = frame_count / video_fps
-                # Convert BGR to RGB
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                frames.append((frame_rgb, timestamp))
+            if quantize:
+                # Dynamic int8 weights for the linear layers
+                int8_path = path.replace('.onnx', '.int8.onnx')
+                if not os.path.exists(int8_path):
+                    tmp_path = f"{int8_path}.{os.getpid()}.tmp"
+                    quantize_dynamic(path, tmp_path, weight_type=QuantType.QInt8)
+                    os.replace(tmp_path, int8_path)
+                path = int8_path
             
-            frame_count += 1
+            session = ort.InferenceSession(path, providers=providers)
+            encoders.append(
+                lambda batch, session=session: torch.from_numpy(
+                    session.run(None, {'input': np.ascontiguousarray(batch.numpy())})[0]
+                )
+            )
         
-        cap.release()
+        logger.info(f"Using ONNX Runtime CLIP encoders ({', '.join(providers)}, int8={quantize})")
+        return tuple(encoders)
+    
+    def autocast(self):
+        """Mixed-precision context for CLIP forward passes, a no-op on CPU"""
+        return torch.autocast(device_type='cuda', dtype=torch.float16, enabled=self.device == "cuda")
+    
+    def extract_frames(self, video_path: str, fps: float = 1.0) -> List[Tuple[np.ndarray, float]]:
+        """Extract frames from video at specified FPS"""
+        frames = list(self.iter_frames(video_path, fps))
         logger.info(f"Extracted {len(frames)} frames from video")
         return frames
     
-    def generate_embeddings_batch(self, frames: List[np.ndarray]) -> np.ndarray:
-        """Generate CLIP embeddings for a batch of frames"""
-        # Preprocess frames
-        images = []
-        for frame in frames:
-            pil_image = Image.fromarray(frame)
-            preprocessed = self.preprocess(pil_image)
-            images.append(preprocessed)
+    def iter_frames(self, video_path: str, fps: float = 1.0) -> Iterator[Tuple[np.ndarray, float]]:
+        """Yield (frame, timestamp) pairs sampled at specified FPS (BGR arrays, or RGB CUDA tensors from NVDEC)"""
+        for frames, timestamps in self.iter_frame_batches(video_path, fps, PIPELINE_BATCH_SIZE):
+            yield from zip(frames, timestamps.tolist())
+    
+    def iter_frame_batches(self, video_path: str, fps: float, batch_size: int) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """Yield (frames, timestamps) batches of frames sampled at specified FPS"""
+        if self.gpu_decode:
+            yielded = False
+            try:
+                for batch in self.iter_frame_batches_gpu(video_path, fps, batch_size):
+                    yielded = True
+                    yield batch
+                return
+            except Exception as e:
+                # Only fall back if nothing was produced yet, otherwise frames would repeat
+                if yielded:
+                    raise
+                logger.warning(f"GPU decoding failed for {video_path}, falling back to OpenCV: {e}")
+        
+        yield from self.iter_frame_batches_cpu(video_path, fps, batch_size)
+    
+    def iter_frame_batches_cpu(self, video_path: str, fps: float, batch_size: int) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """Decode with OpenCV into preallocated (N, H, W, 3) BGR uint8 batches"""
+        cap = cv2.VideoCapture(video_path)
+        try:
+            video_fps = cap.get(cv2.CAP_PROP_FPS)
+            frame_interval = max(1, int(video_fps / fps))
+            
+            frames_arr, ts_arr, count, shape = None, None, 0, None
+            frame_count = 0
+            while True:
+                # grab() only advances the decoder; skipped frames are never
+                # converted to BGR or copied into a numpy array
+                if not cap.grab():
+                    break
+                
+                if frame_count % frame_interval == 0:
+                    if frames_arr is None and shape is not None:
+                        frames_arr = self.alloc_frame_buffer((batch_size,) + shape)
+                        ts_arr = np.empty(batch_size, dtype=np.float32)
+                    # Decode straight into the next batch slot
+                    slot = frames_arr[count] if frames_arr is not None else None
+                    ret, frame = cap.retrieve(slot)
+                    if not ret:
+                        break
+                    # OpenCV allocates a new array for the first frame or when the
+                    # resolution changes; start a batch shaped for it
+                    if slot is None or not np.shares_memory(frame, slot):
+                        if count:
+                            yield frames_arr[:count], ts_arr[:count]
+                        shape = frame.shape
+                        frames_arr = self.alloc_frame_buffer((batch_size,) + shape)
+                        ts_arr = np.empty(batch_size, dtype=np.float32)
+                        count = 0
+                        frames_arr[0] = frame
+                    ts_arr[count] = frame_count / video_fps
+                    count += 1
+                    
+                    if count == batch_size:
+                        yield frames_arr, ts_arr
+                        frames_arr, count = None, 0
+                
+                frame_count += 1
+            
+            if frames_arr is not None and count:
+                yield frames_arr[:count], ts_arr[:count]
+        finally:
+            cap.release()
+    
+    def alloc_frame_buffer(self, shape: Tuple[int, ...]) -> np.ndarray:
+        """Allocate a uint8 frame buffer, page-locked when frames will be copied to the GPU"""
+        if self.copy_stream is not None:
+            return torch.empty(shape, dtype=torch.uint8, pin_memory=True).numpy()
+        return np.empty(shape, dtype=np.uint8)
+    
+    def upload_batch(self, frames: np.ndarray) -> torch.Tensor:
+        """Copy a pinned frame batch to the GPU on the copy stream"""
+        with torch.cuda.stream(self.copy_stream):
+            gpu_frames = torch.from_numpy(frames).to(self.device, non_blocking=True)
+        # Allocated on the copy stream but consumed on the default (compute) stream
+        gpu_frames.record_stream(torch.cuda.default_stream(self.device))
+        # Only the calling (reader) thread waits; compute keeps running meanwhile
+        self.copy_stream.synchronize()
+        return gpu_frames
+    
+    def iter_frame_batches_gpu(self, video_path: str, fps: float, batch_size: int) -> Iterator[Tuple[torch.Tensor, np.ndarray]]:
+        """Decode with NVDEC into preallocated (N, H, W, 3) RGB uint8 CUDA batches"""
+        reader = torchvision.io.VideoReader(video_path, "video")
+        video_fps = reader.get_metadata()["video"]["fps"][0]
+        frame_interval = max(1, int(video_fps / fps))
+        
+        frames_arr, ts_arr, count = None, None, 0
+        for frame_count, frame in enumerate(reader):
+            if frame_count % frame_interval != 0:
+                continue
+            data = frame["data"]
+            if data.shape[0] == 3:
+                data = data.permute(1, 2, 0)
+            if frames_arr is not None and (count == batch_size or frames_arr.shape[1:] != data.shape):
+                yield frames_arr[:count], ts_arr[:count]
+                frames_arr = None
+            if frames_arr is None:
+                frames_arr = torch.empty((batch_size,) + tuple(data.shape), dtype=torch.uint8, device=data.device)
+                ts_arr = np.empty(batch_size, dtype=np.float32)
+                count = 0
+            frames_arr[count].copy_(data)
+            ts_arr[count] = frame_count / video_fps
+            count += 1
         
-        # Stack into batch tensor
-        image_batch = torch.stack(images).to(self.device)
+        if frames_arr is not None and count:
+            yield frames_arr[:count], ts_arr[:count]
+    
+    def preprocess_batch(self, frames, bgr: bool = True) -> torch.Tensor:
+        """Resize, center-crop and normalize an (N, H, W, 3) uint8 BGR (or RGB) batch on the model device"""
+        if isinstance(frames, np.ndarray):
+            frames = torch.from_numpy(frames)
+        frames = frames.to(self.device, non_blocking=True)
+        
+        # Convert and resize a few frames at a time: a full float32 batch of 4K
+        # frames would take gigabytes of device memory before being downscaled
+        height, width = frames.shape[1:3]
+        chunk = max(1, PREPROCESS_MAX_PIXELS // (height * width))
+        return torch.cat([
+            self.preprocess_chunk(frames[start:start + chunk], bgr)
+            for start in range(0, frames.shape[0], chunk)
+        ])
+    
+    def preprocess_chunk(self, frames: torch.Tensor, bgr: bool) -> torch.Tensor:
+        """Preprocess a slice of a frame batch already on the model device"""
+        size = self.input_resolution
+        batch = frames.permute(0, 3, 1, 2).float().div_(255)
+        
+        # Same geometry as CLIP's transform: bicubic resize of the short side, then center crop
+        height, width = batch.shape[-2:]
+        scale = size / min(height, width)
+        new_height, new_width = max(size, round(height * scale)), max(size, round(width * scale))
+        batch = F.interpolate(batch, size=(new_height, new_width), mode='bicubic', align_corners=False, antialias=True)
+        batch = batch.clamp_(0, 1)
+        top = int(round((new_height - size) / 2.0))
+        left = int(round((new_width - size) / 2.0))
+        if bgr:
+            # Reversing channels on the crop is cheaper than converting each decoded frame
+            batch = batch[:, [2, 1, 0], top:top + size, left:left + size]
+        else:
+            batch = batch[:, :, top:top + size, left:left + size]
+        
+        return (batch - self.clip_mean) / self.clip_std
+    
+    def generate_embeddings_batch(self, frames, bgr: bool = True) -> np.ndarray:
+        """Generate CLIP embeddings for an (N, H, W, 3) BGR (or RGB) batch of frames"""
+        if isinstance(frames, list):
+            frames = torch.stack(frames) if isinstance(frames[0], torch.Tensor) else np.asarray(frames)
+        # Preprocess the whole batch as one tensor; GPU-decoded frames are already on the device
+        return self.encode_image_batch(self.preprocess_batch(frames, bgr))
+    
+    def encode_image_batch(self, image_batch: torch.Tensor) -> np.ndarray:
+        """Encode a preprocessed (N, 3, S, S) batch into normalized CLIP embeddings"""
+        # Pad short batches so the compiled encoder always sees one input shape
+        num_frames = image_batch.shape[0]
+        if self.compiled_encoder and num_frames < PIPELINE_BATCH_SIZE:
+            image_batch = F.pad(image_batch, (0, 0, 0, 0, 0, 0, 0, PIPELINE_BATCH_SIZE - num_frames))
         
-        # Generate embeddings
-        with torch.no_grad():
-            embeddings = self.model.encode_image(image_batch)
-            embeddings = embeddings / embeddings.norm(dim=-1, keepdim=True)  # Normalize
+        # Generate embeddings (FP16 on GPU, normalized in FP32)
+        with torch.no_grad(), self.autocast():
+            try:
+                embeddings = self.encode_image(image_batch)
+            except Exception as e:
+                if not self.compiled_encoder:
+                    raise
+                logger.warning(f"Compiled CLIP encoder failed, falling back to eager mode: {e}")
+                self.compiled_encoder = False
+                self.encode_image = self.model.encode_image
+                embeddings = self.encode_image(image_batch)
+        embeddings = F.normalize(embeddings[:num_frames].float(), dim=-1)
         
         return embeddings.cpu().numpy()
     
-    def process_video(self, video_id: int, video_path: str):
-        """Main video processing pipeline"""
+    def process_video(self, video_id: int, video_path: str, user_id: Optional[str] = None):
+        """Main video processing pipeline.
+        
+        Decoding, CLIP inference and Milvus inserts run as three overlapping
+        stages: a reader thread fills read_q with frame batches, this thread
+        embeds them into write_q, and a writer thread stores them.
+        """
         try:
             # Update status to INDEXING
             self.update_video_status(video_id, 'INDEXING')
             
-            # Extract frames
-            frames_data = self.extract_frames(video_path, fps=1.0)
-            if not frames_data:
-                logger.error(f"No frames extracted from video {video_path}")
-                self.update_video_status(video_id, 'FAILED')
-                return
-            frames = [frame for frame, _ in frames_data]
-            timestamps = [timestamp for _, timestamp in frames_data]
+            # Frames go to the owner's partition so searches only touch their segments
+            partition_name = self.ensure_user_partition(user_id) if user_id else None
+            
+            read_q = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+            write_q = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+            stop = threading.Event()
+            errors = []
+            
+            # Without a GPU, preprocessing the next batch in the reader overlaps it
+            # with encoding the current one instead of running them back to back
+            preprocess_in_reader = self.device == "cpu"
+            
+            def read_stage():
+                try:
+                    for frames, timestamps in self.iter_frame_batches(video_path, fps=1.0, batch_size=PIPELINE_BATCH_SIZE):
+                        # OpenCV batches are BGR numpy arrays, NVDEC batches RGB CUDA tensors
+                        bgr = isinstance(frames, np.ndarray)
+                        # Upload the next batch while the current one is being encoded
+                        if self.copy_stream is not None and bgr:
+                            frames = self.upload_batch(frames)
+                        if preprocess_in_reader:
+                            frames = self.preprocess_batch(frames, bgr)
+                        if not put_until_stopped(read_q, (frames, timestamps, bgr), stop):
+                            return
+                except Exception as e:
+                    errors.append(e)
+                    stop.set()
+                finally:
+                    put_until_stopped(read_q, None, stop)
+            
+            # Batches past BULK_INSERT_THRESHOLD rows are held back for one bulk import
+            bulk_embeddings, bulk_timestamps = [], []
+            
+            def write_stage():
+                frame_number = 0
+                try:
+                    while True:
+                        item = get_until_stopped(write_q, stop)
+                        if item is None:
+                            return
+                        embeddings, timestamps = item
+                        if BULK_INSERT_ENABLED and (bulk_embeddings or frame_number + len(embeddings) > BULK_INSERT_THRESHOLD):
+                            bulk_embeddings.append(embeddings)
+                            bulk_timestamps.append(timestamps)
+                        else:
+                            self.store_embeddings(
+                                video_id, embeddings, timestamps,
+                                first_frame_number=frame_number, partition_name=partition_name
+                            )
+                            frame_number += len(embeddings)
+                except Exception as e:
+                    errors.append(e)
+                    stop.set()
+            
+            reader = threading.Thread(target=read_stage, name=f"video-{video_id}-reader", daemon=True)
+            writer = threading.Thread(target=write_stage, name=f"video-{video_id}-writer", daemon=True)
+            reader.start()
+            writer.start()
             
             # Process frames in batches
-            batch_size = 32
-            all_embeddings = []
+            num_frames = 0
+            num_batches = 0
+            try:
+                while True:
+                    batch = get_until_stopped(read_q, stop)
+                    if batch is None:
+                        break
+                    batch_frames, batch_timestamps, bgr = batch
+                    if preprocess_in_reader:
+                        batch_embeddings = self.encode_image_batch(batch_frames)
+                    else:
+                        batch_embeddings = self.generate_embeddings_batch(batch_frames, bgr)
+                    if not put_until_stopped(write_q, (batch_embeddings, batch_timestamps), stop):
+                        break
+                    num_frames += len(batch_frames)
+                    num_batches += 1
+                    logger.info(f"Processed batch {num_batches} ({num_frames} frames)")
+                put_until_stopped(write_q, None, stop)
+            except Exception:
+                stop.set()
+                raise
+            finally:
+                writer.join()
+                reader.join()
             
-            for i in range(0, len(frames), batch_size):
-                batch_frames = frames[i:i + batch_size]
-                batch_embeddings = self.generate_embeddings_batch(batch_frames)
-                all_embeddings.extend(batch_embeddings)
-                
-                logger.info(f"Processed batch {i//batch_size + 1}/{(len(frames) + batch_size - 1)//batch_size}")
+            if errors:
+                raise errors[0]
             
-            # Store embeddings in Milvus
-            self.store_embeddings(video_id, all_embeddings, timestamps)
+            if not num_frames:
+                logger.error(f"No frames extracted from video {video_path}")
+                self.update_video_status(video_id, 'FAILED')
+                return
+            
+            if bulk_embeddings:
+                bulk_embeddings = np.concatenate(bulk_embeddings)
+                bulk_timestamps = np.concatenate(bulk_timestamps)
+                first_frame_number = num_frames - len(bulk_embeddings)
+                try:
+                    task_id, files = self.bulk_insert_embeddings(
+                        video_id, bulk_embeddings, bulk_timestamps, first_frame_number, partition_name
+                    )
+                except Exception as e:
+                    # Staging or submitting the import failed; insert the held-back rows directly
+                    logger.warning(f"Bulk import unavailable for video {video_id}, inserting directly: {e}")
+                    for start in range(0, len(bulk_embeddings), BULK_INSERT_THRESHOLD):
+                        end = start + BULK_INSERT_THRESHOLD
+                        self.store_embeddings(
+                            video_id, bulk_embeddings[start:end], bulk_timestamps[start:end],
+                            first_frame_number=first_frame_number + start, partition_name=partition_name
+                        )
+                else:
+                    # The status is set to COMPLETED once Milvus finishes the import
+                    self.watch_bulk_insert(video_id, task_id, files)
+                    logger.info(f"Started bulk import of {len(bulk_embeddings)} embeddings for video {video_id} (task {task_id})")
+                    return
             
             # Update status to COMPLETED
             self.update_video_status(video_id, 'COMPLETED')
-            logger.info(f"Successfully processed video {video_id}")
+            logger.info(f"Successfully processed video {video_id} ({num_frames} frames)")
             
         except Exception as e:
             logger.error(f"Error processing video {video_id}: {e}")
+            # Drop any batches that were already stored before the failure
+            try:
+                self.delete_video_frames(video_id)
+            except Exception as cleanup_error:
+                logger.warning(f"Failed to remove partial embeddings for video {video_id}: {cleanup_error}")
             self.update_video_status(video_id, 'FAILED')
             raise
     
-    def store_embeddings(self, video_id: int, embeddings: List[np.ndarray], timestamps: List[float]):
+    def store_embeddings(self, video_id: int, embeddings: np.ndarray, timestamps: np.ndarray, first_frame_number: int = 0, partition_name: Optional[str] = None):
         """Store embeddings in Milvus"""
-        if not embeddings:
+        if len(embeddings) == 0:
             logger.error(f"No embeddings to store for video {video_id}")
             return
+        # One contiguous (N, 512) float32 block rather than a list of row arrays
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
         data = [
             [video_id] * len(embeddings),  # video_id
-            list(range(len(embeddings))),  # frame_number
-            timestamps,  # timestamp_sec
+            list(range(first_frame_number, first_frame_number + len(embeddings))),  # frame_number
+            np.asarray(timestamps, dtype=np.float32).tolist(),  # timestamp_sec
             embeddings  # embedding
         ]
         
-        self.collection.insert(data)
-        self.collection.flush()
+        # No flush here: inserted rows are searchable from growing segments and
+        # Milvus seals them on its own schedule
+        self.collection.insert(data, partition_name=partition_name)
         logger.info(f"Stored {len(embeddings)} embeddings for video {video_id}")
     
+    def bulk_insert_embeddings(self, video_id: int, embeddings: np.ndarray, timestamps: np.ndarray, first_frame_number: int = 0, partition_name: Optional[str] = None) -> Tuple[int, List[str]]:
+        """Stage embeddings as column .npy files in Milvus' bucket and start a bulk import"""
+        num_rows = len(embeddings)
+        columns = {
+            "video_id": np.full(num_rows, video_id, dtype=self.int_field_dtypes["video_id"]),
+            "frame_number": np.arange(first_frame_number, first_frame_number + num_rows, dtype=self.int_field_dtypes["frame_number"]),
+            "timestamp_sec": np.asarray(timestamps, dtype=np.float32),
+            "embedding": np.ascontiguousarray(embeddings, dtype=np.float32),
+        }
+        
+        files = []
+        try:
+            for field_name, column in columns.items():
+                buf = io.BytesIO()
+                np.save(buf, column)
+                buf.seek(0)
+                object_name = f"bulk_insert/video_{video_id}/{field_name}.npy"
+                self.minio_client.put_object(MILVUS_BUCKET_NAME, object_name, buf, length=buf.getbuffer().nbytes)
+                files.append(object_name)
+            
+            task_id = utility.do_bulk_insert(collection_name=self.collection.name, partition_name=partition_name, files=files)
+        except Exception:
+            self.remove_bulk_insert_files(files)
+            raise
+        return task_id, files
+    
+    def resume_bulk_inserts(self):
+        """Re-attach watchers to bulk imports whose watcher died with a previous process"""
+        if not BULK_INSERT_ENABLED:
+            return
+        try:
+            # Staged files are named bulk_insert/video_<id>/..., which identifies the video
+            tasks = {}
+            for task in utility.list_bulk_insert_tasks(collection_name=self.collection.name):
+                match = re.match(r"bulk_insert/video_(\d+)/", task.files[0]) if task.files else None
+                if match:
+                    tasks[int(match.group(1))] = task
+            if not tasks:
+                return
+            
+            with self.conn() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(
+                        "SELECT id FROM videos WHERE indexing_status = 'INDEXING' AND id = ANY(%s)",
+                        (list(tasks),)
+                    )
+                    indexing = [row[0] for row in cursor.fetchall()]
+                conn.commit()
+            
+            for video_id in indexing:
+                task = tasks[video_id]
+                logger.info(f"Resuming bulk import watch for video {video_id} (task {task.task_id})")
+                self.watch_bulk_insert(video_id, task.task_id, task.files)
+        except Exception as e:
+            logger.error(f"Failed to resume bulk imports: {e}")
+    
+    def remove_bulk_insert_files(self, files: List[str]):
+        """Best-effort removal of staged bulk import files"""
+        for object_name in files:
+            try:
+                self.minio_client.remove_object(MILVUS_BUCKET_NAME, object_name)
+            except Exception as e:
+                logger.warning(f"Failed to remove bulk import file {object_name}: {e}")
+    
+    def watch_bulk_insert(self, video_id: int, task_id: int, files: List[str]):
+        """Poll a bulk import in the background and record the video's final status"""
+        def poll():
+            status = 'FAILED'
+            try:
+                while True:
+                    state = utility.get_bulk_insert_state(task_id)
+                    if state.state == BulkInsertState.ImportCompleted:
+                        status = 'COMPLETED'
+                        logger.info(f"Bulk import finished for video {video_id} ({state.row_count} rows)")
+                        break
+                    if state.state in (BulkInsertState.ImportFailed, BulkInsertState.ImportFailedAndCleaned):
+                        logger.error(f"Bulk import failed for video {video_id}: {state.failed_reason}")
+                        break
+                    time.sleep(BULK_INSERT_POLL_INTERVAL)
+            except Exception as e:
+                logger.error(f"Error polling bulk import for video {video_id}: {e}")
+            
+            if status == 'FAILED':
+                try:
+                    self.delete_video_frames(video_id)
+                except Exception as e:
+                    logger.warning(f"Failed to remove partial embeddings for video {video_id}: {e}")
+            self.update_video_status(video_id, status)
+            self.remove_bulk_insert_files(files)
+        
+        threading.Thread(target=poll, name=f"video-{video_id}-bulk-insert", daemon=True).start()
+    
+    def finalize(self):
+        """Flush pending inserts and deletes to sealed segments, e.g. at the end of a batch job"""
+        self.collection.flush()
+    
+    @contextmanager
+    def conn(self):
+        """Borrow a pooled PostgreSQL connection with PREPARED_STATEMENTS prepared"""
+        with self.pg_slots:
+            conn = self.pg_pool.getconn()
+            try:
+                if conn not in self.prepared_conns:
+                    with conn.cursor() as cursor:
+                        for name, sql in PREPARED_STATEMENTS.items():
+                            cursor.execute(f"PREPARE {name} AS {sql}")
+                    conn.commit()
+                    self.prepared_conns.add(conn)
+                yield conn
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                self.pg_pool.putconn(conn)
+    
     def update_video_status(self, video_id: int, status: str):
         """Update video indexing status in PostgreSQL"""
-        with self.pg_conn.cursor() as cursor:
-            cursor.execute(
-                "UPDATE videos SET indexing_status = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s",
-                (status, video_id)
-            )
-            self.pg_conn.commit()
+        with self.conn() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("EXECUTE upd_status (%s, %s)", (status, video_id))
+            conn.commit()
+    
+    def encode_texts(self, query_texts: List[str]) -> np.ndarray:
+        """Generate normalized CLIP text embeddings for a batch of queries"""
+        return self.encode_tokens(clip.tokenize(query_texts))
+    
+    def encode_tokens(self, text_tokens: torch.Tensor) -> np.ndarray:
+        """Generate normalized CLIP text embeddings for a batch of tokenized queries"""
+        text_tokens = text_tokens.to(self.device)
+        with torch.no_grad(), self.autocast():
+            query_embeddings = self.encode_text(text_tokens)
+        query_embeddings = F.normalize(query_embeddings.float(), dim=-1)
+        
+        return query_embeddings.cpu().numpy()
     
     def search_global(self, query_text: str, user_id: str, limit: int = 5) -> List[Dict]:
         """Perform global semantic search across all user's videos"""
-        # Generate query embedding
-        text_tokens = clip.tokenize([query_text]).to(self.device)
-        with torch.no_grad():
-            query_embedding = self.model.encode_text(text_tokens)
-            query_embedding = query_embedding / query_embedding.norm(dim=-1, keepdim=True)
-        
-        query_vector = query_embedding.cpu().numpy().flatten().tolist()
-        
         # Get user's completed videos
-        with self.pg_conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                "SELECT id, title FROM videos WHERE user_id = %s AND indexing_status = 'COMPLETED'",
-                (user_id,)
-            )
-            user_videos = cursor.fetchall()
+        with self.conn() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("EXECUTE completed_user_videos (%s)", (user_id,))
+                user_videos = cursor.fetchall()
+            conn.commit()
         
         if not user_videos:
             return []
         
         video_ids = [video['id'] for video in user_videos]
+        titles = {video['id']: video['title'] for video in user_videos}
         
-        # Search in Milvus
-        search_params = {"metric_type": "COSINE", "params": {"nprobe": 10}}
+        # Search in Milvus. The user's partition prunes other users' segments; the
+        # expr still limits hits to COMPLETED videos within it
+        expr = f"video_id in {video_ids}"
+        partitions = self.user_search_partitions(user_id, hash(frozenset(video_ids)))
         
-        # Search for each video and get the best match
-        results = []
-        for video_id in video_ids:
-            # Filter by video_id
-            expr = f"video_id == {video_id}"
+        # One search across all of the user's videos, keeping the best hit per video.
+        # A video absent from the hits scores below every returned hit, so once
+        # `limit` distinct videos are found they are the true top results. Users with
+        # fewer videos than `limit` are done once every one of them has a hit.
+        # Wider retries reuse the vector encoded by the first round.
+        wanted = min(limit, len(video_ids))
+        query = query_text
+        topk = min(MILVUS_MAX_TOPK, limit * GLOBAL_SEARCH_OVERSAMPLE)
+        while True:
+            query, hits = self.query_batcher.search(query, expr, topk, partitions)
             
-            search_results = self.collection.search(
-                data=[query_vector],
-                anns_field="embedding",
-                param=search_params,
-                limit=1,
-                expr=expr,
-                output_fields=["video_id", "frame_number", "timestamp_sec"]
-            )
+            best_hits = {}
+            for hit in hits:
+                # Hits come back sorted by score, so the first one per video is its best
+                best_hits.setdefault(hit.entity.get('video_id'), hit)
             
-            if search_results[0]:
-                hit = search_results[0][0]
-                video_info = next(v for v in user_videos if v['id'] == video_id)
-                
-                results.append({
-                    'video_id': video_id,
-                    'title': video_info['title'],
-                    'similarity': float(hit.score),
-                    'timestamp': float(hit.entity.get('timestamp_sec')),
-                    'frame_number': int(hit.entity.get('frame_number'))
-                })
+            if len(best_hits) >= wanted or len(hits) < topk or topk == MILVUS_MAX_TOPK:
+                break
+            topk = min(MILVUS_MAX_TOPK, topk * 4)
+        
+        results = [
+            {
+                'video_id': video_id,
+                'title': titles[video_id],
+                'similarity': float(hit.score),
+                'timestamp': float(hit.entity.get('timestamp_sec')),
+                'frame_number': int(hit.entity.get('frame_number'))
+            }
+            for video_id, hit in best_hits.items()
+        ]
         
         # Sort by similarity and return top results
         results.sort(key=lambda x: x['similarity'], reverse=True)
         return results[:limit]
     
-    def search_in_video(self, query_text: str, video_id: int, limit: int = 10) -> List[Dict]:
+    def search_in_video(self, query_text: str, video_id: int, limit: int = 10, user_id: Optional[str] = None) -> List[Dict]:
         """Perform semantic search within a specific video"""
-        # Generate query embedding
-        text_tokens = clip.tokenize([query_text]).to(self.device)
-        with torch.no_grad():
-            query_embedding = self.model.encode_text(text_tokens)
-            query_embedding = query_embedding / query_embedding.norm(dim=-1, keepdim=True)
-        
-        query_vector = query_embedding.cpu().numpy().flatten().tolist()
-        
-        # Search in Milvus for specific video
-        search_params = {"metric_type": "COSINE", "params": {"nprobe": 10}}
+        # Search in Milvus for specific video, within its owner's partitions when known
         expr = f"video_id == {video_id}"
-        
-        self.collection.load() # <-- Add this line
-        search_results = self.collection.search(
-            data=[query_vector],
-            anns_field="embedding",
-            param=search_params,
-            limit=limit,
-            expr=expr,
-            output_fields=["video_id", "frame_number", "timestamp_sec"]
-        )
+        partitions = self.user_search_partitions(user_id, video_id) if user_id else None
+        _, hits = self.query_batcher.search(query_text, expr, limit, partitions)
         
         results = []
-        if search_results[0]:
-            for hit in search_results[0]:
+        if hits:
+            for hit in hits:
                 results.append({
                     'timestamp': float(hit.entity.get('timestamp_sec')),
                     'frame_number': int(hit.entity.get('frame_number')),
@@ -306,7 +1015,6 @@ class VideoProcessor:
         """Delete all frame embeddings for a video from Milvus"""
         expr = f"video_id == {video_id}"
         num_deleted = self.collection.delete(expr)
-        self.collection.flush()
         logger.info(f"Deleted frames for video_id={video_id} from Milvus: {num_deleted}")
         return num_deleted
 
@@ -318,13 +1026,14 @@ async def main():
     video_id = 1
     video_path = "/Users/tewff14/Documents/qmv3/some_real_video.mp4"
     
-    processor.process_video(video_id, video_path)
+    processor.process_video(video_id, video_path, "user123")
+    processor.finalize()
     
     # Perform searches
     global_results = processor.search_global("dog playing fetch", "user123", limit=5)
     print("Global search results:", global_results)
     
-    in_video_results = processor.search_in_video("sunset over ocean", video_id, limit=5)
+    in_video_results = processor.search_in_video("sunset over ocean", video_id, limit=5, user_id="user123")
     print("In-video search results:", in_video_results)
 
 if __name__ == "__main__":